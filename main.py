@@ -1,15 +1,32 @@
+import os
+import errno
+import re
 import cv2
+import select
 import socket
 import subprocess
 import platform
 import numpy as np
 import time
 import threading
-from collections import deque
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from queue import Queue
+import heapq
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from queue import Empty, Queue
 from wsdiscovery import WSDiscovery
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+try:
+    from icmplib import ICMPv4Socket, SocketPermissionError, multiping as icmp_multiping
+except ImportError:
+    icmp_multiping = None
+
 
 # -------- SETTINGS --------
 RTSP_PATH = "/profile2/media.smp"
@@ -17,26 +34,106 @@ TIMEOUT = 1
 MAX_THREADS = 50
 FRAME_WIDTH = 1440
 FRAME_HEIGHT = 720
+MAX_CAMS = 16 # frame buffers preallocated for this many cameras
+MAX_STREAM_LAG = 0.2 # seconds behind real time before queued frames are skipped
+MAX_SKIPPED_FRAMES = 30
+IDLE_REDRAW_INTERVAL = 1.0 # redraw this often even without new frames, keeps FPS text live
+OVERLAY_HEIGHT = 130 # text overlay area in the top-left of each tile
+OVERLAY_WIDTH = 500
 
 DISCOVERY_INTERVAL = 1 # seconds between discovery runs
+DISCOVERY_MAX_INTERVAL = 30 # back-off limit once the camera set is stable
 PING_INTERVAL = 1             
 PING_LOSS_TIMEOUT = 3 # seconds before removing camera
+XADDR_CACHE_SIZE = 256 # parsed WS-Discovery services remembered
+
+# Stalled RTSP reads give up after this long so camera threads can exit
+READ_TIMEOUT_USEC = 1000000
+
+# Hardware H.264 decoders tried in order (NVIDIA, VA-API, V4L2)
+GST_DECODERS = ["nvh264dec", "vaapih264dec", "v4l2h264dec"]
 
+# Use TCP for RTSP and time out stalled sockets instead of hanging
+# (FFmpeg 5+ socket timeout, replaced stimeout)
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", f"rtsp_transport;tcp|timeout;{READ_TIMEOUT_USEC}")
 
-def ping(ip):
-    """Pings device to make sure it is still reachable."""
+GSTREAMER_AVAILABLE = re.search(r"GStreamer:\s*YES", cv2.getBuildInformation()) is not None
+
+
+def ping_command(ip):
+    """OS ping command for a single echo request."""
     system = platform.system().lower()
 
     if system == "windows":
-        cmd = ["ping", "-n", "1", "-w", "500", ip]
-    else:
-        cmd = ["ping", "-c", "1", "-W", "1", ip]
+        return ["ping", "-n", "1", "-w", "500", ip]
+    return ["ping", "-c", "1", "-W", "1", ip]
 
-    try:
-        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        return result.returncode == 0
-    except:
-        return False
+
+# None until probed, then whether unprivileged ICMP sockets can be used
+_icmp_allowed = None
+
+
+def icmp_allowed():
+    """Check once whether icmplib can open unprivileged ICMP sockets."""
+    global _icmp_allowed
+    if _icmp_allowed is None:
+        _icmp_allowed = False
+        if icmp_multiping is not None:
+            try:
+                ICMPv4Socket(privileged=False).close()
+                _icmp_allowed = True
+            except SocketPermissionError:
+                # e.g. Linux ping_group_range excludes us
+                print("Unprivileged ICMP not permitted, using OS ping")
+            except:
+                pass
+    return _icmp_allowed
+
+
+def multi_ping(ips):
+    """Pings all devices at once, returns {ip: alive}."""
+    global _icmp_allowed
+    if not ips:
+        return {}
+
+    if icmp_allowed():
+        try:
+            hosts = icmp_multiping(ips, count=1, interval=0.01, timeout=1, privileged=False)
+            return {host.address: host.is_alive for host in hosts}
+        except SocketPermissionError:
+            _icmp_allowed = False
+        except:
+            pass
+
+    return subprocess_multi_ping(ips)
+
+
+def subprocess_multi_ping(ips):
+    """Starts an OS ping for every device first, then collects them."""
+    procs = []
+    for ip in ips:
+        try:
+            proc = subprocess.Popen(ping_command(ip), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except:
+            proc = None
+        procs.append((ip, proc))
+        # Small stagger so the kernel doesn't drop a burst of ICMP packets
+        time.sleep(0.01)
+
+    # One shared deadline for all pings, slightly over the ping timeout
+    deadline = time.time() + 1.2
+    results = {}
+    for ip, proc in procs:
+        if proc is None:
+            results[ip] = False
+            continue
+        try:
+            results[ip] = proc.wait(timeout=max(0, deadline - time.time())) == 0
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            results[ip] = False
+    return results
 
 
 def check_rtsp(ip):
@@ -51,6 +148,52 @@ def check_rtsp(ip):
         return False
 
 
+# connect_ex() codes for a non-blocking connect still in progress
+CONNECT_IN_PROGRESS = {errno.EINPROGRESS, errno.EWOULDBLOCK, 10035} # 10035: WSAEWOULDBLOCK
+
+
+def check_rtsp_batch(ips):
+    """Check RTSP port 554 on many devices at once, returns {ip: open}."""
+    results = {ip: False for ip in ips}
+
+    socks = {}
+    for ip in ips:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setblocking(False)
+        try:
+            err = s.connect_ex((ip, 554))
+        except:
+            err = None
+
+        if err in CONNECT_IN_PROGRESS:
+            socks[s] = ip
+        else:
+            # Connected or failed straight away (unreachable, refused, ...)
+            results[ip] = err == 0
+            s.close()
+
+    # Wait for every connect to complete or fail, up to TIMEOUT in total
+    pending = list(socks)
+    deadline = time.time() + TIMEOUT
+    try:
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+
+            _, writable, failed = select.select([], pending, pending, remaining)
+            for s in writable:
+                results[socks[s]] = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+
+            done = set(writable) | set(failed)
+            pending = [s for s in pending if s not in done]
+    finally:
+        for s in socks:
+            s.close()
+
+    return results
+
+
 def test_feed(ip):
     """Try opening the RTSP stream."""
     url = f"rtsp://{ip}{RTSP_PATH}"
@@ -68,90 +211,348 @@ def scan_ip(ip):
     return None
 
 
-def discover_cameras(timeout=1):
+# Service EPR -> (XAddrs, camera IPs), most recently used last
+_xaddr_cache = OrderedDict()
+
+
+def service_ips(service):
+    """Camera IPs advertised by a WS-Discovery service, cached by EPR."""
+    epr = service.getEPR()
+    xaddrs = tuple(service.getXAddrs())
+
+    cached = _xaddr_cache.get(epr)
+    if cached is not None and cached[0] == xaddrs:
+        _xaddr_cache.move_to_end(epr)
+        return cached[1]
+
+    ips = []
+    for addr in xaddrs:
+        try:
+            host = addr.split("//")[1].split("/")[0]
+            ip = host.split(":")[0]
+            if ip.startswith("10."):
+                ips.append(ip)
+        except:
+            pass
+
+    _xaddr_cache[epr] = (xaddrs, ips)
+    _xaddr_cache.move_to_end(epr)
+    if len(_xaddr_cache) > XADDR_CACHE_SIZE:
+        _xaddr_cache.popitem(last=False)
+    return ips
+
+
+def discover_cameras(timeout=1, wsd=None):
+    """Search for cameras, reusing a started WSDiscovery if given."""
     print("Discovering devices...")
 
-    wsd = WSDiscovery()
-    wsd.start()
+    own_wsd = wsd is None
+    if own_wsd:
+        wsd = WSDiscovery()
+        wsd.start()
+    else:
+        # Forget earlier replies, otherwise cameras that left without a Bye
+        # are returned by every search
+        wsd.clearRemoteServices()
 
-    services = wsd.searchServices(timeout=timeout)
+    try:
+        services = wsd.searchServices(timeout=timeout)
+    finally:
+        if own_wsd:
+            wsd.stop()
 
     cameras = []
     for service in services:
-        for addr in service.getXAddrs():
-            try:
-                host = addr.split("//")[1].split("/")[0]
-                ip = host.split(":")[0]
-                if ip.startswith("10."):
-                    cameras.append(ip)
-            except:
-                pass
+        cameras.extend(service_ips(service))
 
-    wsd.stop()
     return list(set(cameras))
 
 
+def gstreamer_pipeline(url, decoder, frame_width, frame_height):
+    """GStreamer pipeline that decodes the RTSP stream on the GPU/VPU.
+
+    Frames are scaled in YUV before the BGR conversion.
+    """
+    return (
+        f"rtspsrc location={url} latency=0 protocols=tcp tcp-timeout={READ_TIMEOUT_USEC} ! "
+        f"rtph264depay ! h264parse ! {decoder} ! "
+        f"videoscale method=0 ! video/x-raw,width={frame_width},height={frame_height} ! "
+        f"videoconvert ! video/x-raw,format=BGR ! "
+        f"appsink drop=true max-buffers=1 sync=false"
+    )
+
+
+def open_capture(url, frame_width, frame_height):
+    """Open stream with a hardware decoder if possible, else FFmpeg."""
+    if GSTREAMER_AVAILABLE:
+        for decoder in GST_DECODERS:
+            pipeline = gstreamer_pipeline(url, decoder, frame_width, frame_height)
+            cap = cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER)
+            if cap.isOpened():
+                print(f"Decoding {url} with {decoder}")
+                return cap
+            cap.release()
+
+    # Set FFmpeg timeouts to prevent blocking when camera disconnects
+    try:
+        cap = cv2.VideoCapture(
+            url,
+            cv2.CAP_FFMPEG,
+            [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, 1000,
+             cv2.CAP_PROP_READ_TIMEOUT_MSEC, 1000]
+        )
+    except TypeError:
+        # Fallback for OpenCV versions that don't support params
+        cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG)
+
+    # Let swscale inside FFmpeg do the scaling where supported
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, frame_width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, frame_height)
+    # Keep as few decoded frames queued as the backend allows
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return cap
+
+
+def _tile_blit(framestack, slots, fronts, grid, cols):
+    """Copy each camera's front buffer into its tile of the grid."""
+    height = framestack.shape[2]
+    width = framestack.shape[3]
+    for t in range(len(slots)):
+        r, c = divmod(t, cols)
+        grid[r * height:(r + 1) * height,
+             c * width:(c + 1) * width] = framestack[slots[t], fronts[t]]
+
+
+def _tile_blit_rows(framestack, slots, fronts, grid, cols):
+    """Same as _tile_blit, one contiguous row copy per tile line so numba emits memcpys."""
+    height = framestack.shape[2]
+    row_bytes = framestack.shape[3] * 3
+    for i in prange(len(slots) * height):
+        t = i // height
+        y = i % height
+        r = t // cols
+        c = t % cols
+        grid[r * height + y].reshape(-1)[c * row_bytes:(c + 1) * row_bytes] = \
+            framestack[slots[t], fronts[t], y].reshape(-1)
+
+
+if njit is not None:
+    tile_blit = njit(parallel=True, boundscheck=False, cache=True)(_tile_blit_rows)
+else:
+    tile_blit = _tile_blit
+
+
+def warm_up_tile_blit():
+    """Compile the numba kernel ahead of the first camera, off the UI thread."""
+    if njit is None:
+        return
+    try:
+        tile_blit(np.zeros((1, 2, 2, 2, 3), dtype=np.uint8), np.zeros(1, dtype=np.intp),
+                  np.zeros(1, dtype=np.intp), np.zeros((2, 2, 3), dtype=np.uint8), 1)
+    except Exception as e:
+        print(f"Tile blit warm-up error: {e}")
+
+
+@lru_cache(maxsize=None)
+def render_glyphs(font_scale, color, thickness=2, chars="0123456789."):
+    """Pre-render characters with putText, returns {char: (sprite, mask, ascent, pad, advance)}."""
+    glyphs = {}
+    for ch in chars:
+        (w, h), baseline = cv2.getTextSize(ch, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+        pad = thickness
+        sprite = np.zeros((h + baseline + 2 * pad, w + 2 * pad, 3), dtype=np.uint8)
+        cv2.putText(sprite, ch, (pad, h + pad), cv2.FONT_HERSHEY_SIMPLEX,
+                    font_scale, color, thickness)
+        # Hershey getTextSize widths include the thickness once, putText's advance doesn't
+        glyphs[ch] = (sprite, sprite.any(axis=2).astype(np.uint8), h + pad, pad, w - thickness)
+    return glyphs
+
+
+def glyph_rows(y, glyphs):
+    """First and last+1 row any glyph covers when drawn with baseline y."""
+    top = min(y - ascent for _, _, ascent, _, _ in glyphs.values())
+    bottom = max(y - ascent + sprite.shape[0] for sprite, _, ascent, _, _ in glyphs.values())
+    return top, bottom
+
+
+def blit_text(image, text, origin, glyphs, image_mask=None):
+    """Draw text from pre-rendered glyphs, origin is the bottom-left like putText.
+
+    If image_mask is given, the drawn pixels are also marked in it.
+    """
+    x, y = origin
+    for ch in text:
+        sprite, mask, ascent, pad, advance = glyphs[ch]
+        top = y - ascent
+        left = x - pad
+        bottom = top + sprite.shape[0]
+        right = left + sprite.shape[1]
+        if top < 0 or bottom > image.shape[0] or right > image.shape[1]:
+            break
+        cv2.copyTo(sprite, mask, image[top:bottom, left:right])
+        if image_mask is not None:
+            region = image_mask[top:bottom, left:right]
+            cv2.bitwise_or(region, mask, dst=region)
+        x += advance
+
+
+def update_interval(avg_dt, dt):
+    """Exponentially weighted moving average of frame intervals, 0 if none yet."""
+    if avg_dt <= 0:
+        return dt
+    return 0.9 * avg_dt + 0.1 * dt
+
+
+def interval_fps(avg_dt):
+    """Frames per second for an average frame interval."""
+    return 1.0 / avg_dt if avg_dt > 0 else 0.0
+
+
 class CameraCapture(threading.Thread):
     """Camera thread that reads frames."""
-    def __init__(self, url, frame_width, frame_height, fps_window_seconds=5.0):
+    def __init__(self, url, frame_width, frame_height, buffers=None, slot=None):
         super().__init__(daemon=True)
         self.url = url
         self.ip = url.replace("rtsp://", "").split("/")[0]
 
-        # Set FFmpeg timeouts to prevent blocking when camera disconnects
-        try:
-            self.cap = cv2.VideoCapture(
-                self.url,
-                cv2.CAP_FFMPEG,
-                [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, 1000,
-                 cv2.CAP_PROP_READ_TIMEOUT_MSEC, 1000]
-            )
-        except TypeError:
-            # Fallback for OpenCV versions that don't support params
-            self.cap = cv2.VideoCapture(self.url, cv2.CAP_FFMPEG)
-
         self.frame_width = frame_width
         self.frame_height = frame_height
 
-        self.lock = threading.Lock()
-        self.latest_frame = np.zeros((frame_height, frame_width, 3), dtype=np.uint8)
+        self.cap = open_capture(self.url, frame_width, frame_height)
+
+        # Double buffer: run() fills the back buffer then flips front_idx.
+        # Single producer/single consumer, so no lock is needed.
+        if buffers is None:
+            buffers = np.zeros((2, frame_height, frame_width, 3), dtype=np.uint8)
+        self.buffers = buffers
+        self.slot = slot
+        self.front_idx = 0
+        self.frame_seq = 0 # bumped after every buffer swap
         self.running = True
 
-        self.fps_window_seconds = fps_window_seconds
-        self.timestamps = deque()
-        self.avg_fps = 0.0
+        self.last_ts = None
+        self.avg_dt = 0.0
+
+        # appsink already drops stale frames, FFmpeg needs help catching up
+        try:
+            self.skip_backlog = self.cap.getBackendName() == "FFMPEG"
+        except:
+            self.skip_backlog = False
+        self.stream_origin = None
+
+        # Static labels rendered once; FPS values drawn from glyph sprites
+        # only when they change
+        self.ip_overlay = np.zeros((OVERLAY_HEIGHT, OVERLAY_WIDTH, 3), dtype=np.uint8)
+        cv2.putText(self.ip_overlay, f"Camera: {self.ip}", (10, 35),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 255), 2)
+        cv2.putText(self.ip_overlay, "Input FPS: ", (10, 70),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+        cv2.putText(self.ip_overlay, "Output FPS: ", (10, 110),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 200, 255), 2)
+        self.input_fps_x = 10 + cv2.getTextSize("Input FPS: ", cv2.FONT_HERSHEY_SIMPLEX, 0.9, 2)[0][0] - 2
+        self.output_fps_x = 10 + cv2.getTextSize("Output FPS: ", cv2.FONT_HERSHEY_SIMPLEX, 0.9, 2)[0][0] - 2
+        self.input_glyphs = render_glyphs(0.9, (0, 255, 0))
+        self.output_glyphs = render_glyphs(0.9, (0, 200, 255))
+        self.ip_overlay_mask = self.ip_overlay.any(axis=2).astype(np.uint8)
+
+        # Overlay with the current FPS values; each value is redrawn in place
+        self.overlay = self.ip_overlay.copy()
+        self.overlay_mask = self.ip_overlay_mask.copy()
+        self.input_fps_text = None
+        self.output_fps_text = None
+
+    def stream_lag(self, now):
+        """Seconds the stream position has fallen behind wall-clock time."""
+        pos = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        if pos <= 0:
+            # Backend doesn't report timestamps, can't tell
+            return 0.0
+
+        offset = now - pos
+        if self.stream_origin is None or offset < self.stream_origin:
+            self.stream_origin = offset
+        return offset - self.stream_origin
 
     def run(self):
         while self.running:
-            ret, frame = self.cap.read()
-
-            # When asked, exit immediately
+            ret = self.cap.grab()
+
+            # Frames queued while we were busy: grab past them, only retrieve the newest
+            if ret and self.skip_backlog:
+                skipped = 0
+                while (skipped < MAX_SKIPPED_FRAMES and self.running
+                       and self.stream_lag(time.time()) > MAX_STREAM_LAG):
+                    if not self.cap.grab():
+                        break
+                    skipped += 1
+
+                if skipped == MAX_SKIPPED_FRAMES:
+                    # Still behind, timestamps probably jumped; start measuring again
+                    self.stream_origin = None
+
+            # When asked, exit immediately; the slot may be handed to another camera
             if not self.running:
                 break
 
-            now = time.time()
-
+            # Retrieve straight into the back buffer, no intermediate frame
+            back = self.buffers[1 - self.front_idx]
+            frame = None
             if ret:
-                frame = cv2.resize(frame, (self.frame_width, self.frame_height))
+                ret, frame = self.cap.retrieve(back)
 
-                self.timestamps.append(now)
-                while self.timestamps and (now - self.timestamps[0]) > self.fps_window_seconds:
-                    self.timestamps.popleft()
-                self.avg_fps = len(self.timestamps) / self.fps_window_seconds
+            now = time.time()
 
-                with self.lock:
-                    self.latest_frame = frame
+            if ret:
+                # OpenCV allocated a new frame, backend gave a different size/format
+                if frame is not back:
+                    if frame.shape == back.shape:
+                        np.copyto(back, frame)
+                    else:
+                        cv2.resize(frame, (self.frame_width, self.frame_height), dst=back)
+
+                if self.last_ts is not None:
+                    self.avg_dt = update_interval(self.avg_dt, now - self.last_ts)
+                self.last_ts = now
+
+                self.front_idx ^= 1
+                self.frame_seq += 1
             else:
-                # No frame received; short sleep to avoid busy loop
+                # No frame received; decay FPS and short sleep to avoid busy loop
+                self.avg_dt /= 0.9
                 time.sleep(0.05)
 
         self.cap.release()
 
-    def get_frame_and_fps(self):
-        with self.lock:
-            frame = self.latest_frame.copy()
-            fps = self.avg_fps
-        return frame, fps
+    @property
+    def avg_fps(self):
+        return interval_fps(self.avg_dt)
+
+    def redraw_value(self, text, origin, glyphs):
+        """Replace one FPS value in the cached overlay and its mask."""
+        x, y = origin
+        top, bottom = glyph_rows(y, glyphs)
+        top = max(top, 0)
+        left = x - glyphs["0"][3]
+
+        # Restore the static labels under the old value, then draw the new one
+        self.overlay[top:bottom, left:] = self.ip_overlay[top:bottom, left:]
+        self.overlay_mask[top:bottom, left:] = self.ip_overlay_mask[top:bottom, left:]
+        blit_text(self.overlay, text, origin, glyphs, self.overlay_mask)
+
+    def draw_overlay(self, tile, output_fps):
+        """Blit the camera label and FPS text onto a grid tile."""
+        input_text = f"{self.avg_fps:.1f}"
+        if input_text != self.input_fps_text:
+            self.redraw_value(input_text, (self.input_fps_x, 70), self.input_glyphs)
+            self.input_fps_text = input_text
+
+        output_text = f"{output_fps:.1f}"
+        if output_text != self.output_fps_text:
+            self.redraw_value(output_text, (self.output_fps_x, 110), self.output_glyphs)
+            self.output_fps_text = output_text
+
+        # cv2.copyTo with a single-channel uint8 mask is far cheaper than np.copyto(where=)
+        cv2.copyTo(self.overlay, self.overlay_mask, tile[:OVERLAY_HEIGHT, :OVERLAY_WIDTH])
 
     def stop(self):
         """Graceful stop: let the loop exit after current read."""
@@ -170,57 +571,110 @@ class CameraCapture(threading.Thread):
 
 class DeviceManager(threading.Thread):
     """WS-Discovery then pings to check devices are still reachable"""
-    def __init__(self, cameras, lock):
+    def __init__(self):
         super().__init__(daemon=True)
-        self.cameras = cameras
-        self.lock = lock
+        # Copy-on-write: only this thread replaces the tuple, readers take
+        # a reference to it without locking.
+        self.cameras_snapshot = ()
         self.running = True
 
         self.discovery_results = Queue()
         self.last_seen = {}
 
+        # Double-buffered frames for every camera in one array, indexed by slot
+        self.framestack = np.zeros((MAX_CAMS, 2, FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+        self.free_slots = list(range(MAX_CAMS)) # min-heap, lowest slot reused first
+        self.parked_cams = [] # removed cameras whose thread hasn't exited yet
+
+        # Started by discovery_worker and shared by every scan, recreated after errors
+        self.wsd = None
+        self.wsd_lock = threading.Lock()
+
         # Workers
         self.discovery_thread = threading.Thread(
             target=self.discovery_worker,
             daemon=True
         )
-        self.ping_pool = ThreadPoolExecutor(max_workers=20)
 
 
     def discovery_worker(self):
+        # Scan every second while cameras come and go, then back off
+        # exponentially while the set of cameras stays the same.
+        previous = None
+        stable_iters = 0
+
         while self.running:
             try:
-                ips = discover_cameras(timeout=DISCOVERY_INTERVAL)
+                wsd = self.wsd
+                if wsd is None:
+                    self.start_wsd()
+                    wsd = self.wsd
+                    if wsd is None:
+                        break
+
+                ips = discover_cameras(timeout=DISCOVERY_INTERVAL, wsd=wsd)
                 self.discovery_results.put(ips)
+
+                if set(ips) == previous:
+                    stable_iters = min(stable_iters + 1, 5)
+                else:
+                    stable_iters = 0
+                previous = set(ips)
             except Exception as e:
+                # stop() closes WS-Discovery under a running search, that's not an error
+                if not self.running:
+                    break
                 print(f"Discovery error: {e}")
-            time.sleep(DISCOVERY_INTERVAL)
+                stable_iters = 0
+                self.close_wsd()
+
+            time.sleep(min(DISCOVERY_MAX_INTERVAL, DISCOVERY_INTERVAL * (1 << stable_iters)))
+
+
+    def start_wsd(self):
+        """Start the shared WSDiscovery unless the manager is stopping."""
+        wsd = WSDiscovery()
+        wsd.start()
+        with self.wsd_lock:
+            if self.running:
+                self.wsd = wsd
+                return
+        wsd.stop()
+
+    def close_wsd(self):
+        with self.wsd_lock:
+            wsd, self.wsd = self.wsd, None
+        if wsd is not None:
+            try:
+                wsd.stop()
+            except:
+                pass
 
 
     def parallel_ping(self, ips):
-        futures = {self.ping_pool.submit(ping, ip): ip for ip in ips}
-        results = {}
-        for future in as_completed(futures):
-            ip = futures[future]
-            try:
-                results[ip] = future.result()
-            except:
-                results[ip] = False
-        return results
+        return multi_ping(ips)
 
 
     def run(self):
         self.discovery_thread.start()
 
+        last_ping = 0.0
+
         while self.running:
-            # --- Handle new discovery results ---
-            while not self.discovery_results.empty():
-                new_ips = self.discovery_results.get()
+            # --- Wait for discovery results until the next ping is due ---
+            timeout = max(0.0, last_ping + PING_INTERVAL - time.time())
+            try:
+                new_ips = self.discovery_results.get(timeout=timeout)
                 self.handle_discovery(new_ips)
+            except Empty:
+                pass
+
+            if time.time() - last_ping < PING_INTERVAL:
+                continue
+            last_ping = time.time()
 
             # --- Parallel ping all active cameras ---
-            with self.lock:
-                active_ips = list(self.cameras.keys())
+            active_ips = [cam.ip for cam in self.cameras_snapshot]
 
             ping_results = self.parallel_ping(active_ips)
 
@@ -232,22 +686,26 @@ class DeviceManager(threading.Thread):
                     if time.time() - self.last_seen.get(ip, 0) > PING_LOSS_TIMEOUT:
                         self.remove_camera(ip)
 
-            time.sleep(0.1)  # very fast loop
-
 
     def handle_discovery(self, ips):
-        with self.lock:
-            current = set(self.cameras.keys())
+        current = {cam.ip for cam in self.cameras_snapshot}
 
         new_ips = set(ips) - current
+        self.reclaim_slots()
+        rtsp_open = check_rtsp_batch(new_ips)
         for ip in new_ips:
-            if check_rtsp(ip):
+            if rtsp_open[ip]:
+                if not self.free_slots:
+                    print(f"Ignoring camera {ip}: already showing {MAX_CAMS} cameras")
+                    continue
+
+                slot = heapq.heappop(self.free_slots)
                 url = f"rtsp://{ip}{RTSP_PATH}"
-                cam = CameraCapture(url, FRAME_WIDTH, FRAME_HEIGHT)
+                cam = CameraCapture(url, FRAME_WIDTH, FRAME_HEIGHT,
+                                    buffers=self.framestack[slot], slot=slot)
                 cam.start()
 
-                with self.lock:
-                    self.cameras[ip] = cam
+                self.cameras_snapshot = self.cameras_snapshot + (cam,)
 
                 self.last_seen[ip] = time.time()
                 print(f"Added new camera: {ip}")
@@ -255,25 +713,34 @@ class DeviceManager(threading.Thread):
 
     def remove_camera(self, ip):
         print(f"Removing camera: {ip}")
-        with self.lock:
-            cam = self.cameras.pop(ip, None)
+        cam = next((x for x in self.cameras_snapshot if x.ip == ip), None)
+        self.cameras_snapshot = tuple(x for x in self.cameras_snapshot if x.ip != ip)
 
         if cam:
             cam.force_close()
             cam.join(timeout=1)
+            self.parked_cams.append(cam)
+            self.reclaim_slots()
 
         self.last_seen.pop(ip, None)
 
+    def reclaim_slots(self):
+        """Free the slots of removed cameras once their threads have exited."""
+        for cam in [x for x in self.parked_cams if not x.is_alive()]:
+            self.parked_cams.remove(cam)
+            heapq.heappush(self.free_slots, cam.slot)
+
     def stop(self):
-        self.running = False
+        with self.wsd_lock:
+            self.running = False
+        self.close_wsd()
 
 
 def display_multiple_streams():
-    cameras = {}
-    lock = threading.Lock()
+    threading.Thread(target=warm_up_tile_blit, daemon=True).start()
 
     # Start discovery
-    manager = DeviceManager(cameras, lock)
+    manager = DeviceManager()
     manager.start()
 
     window_name = "Control RoboSpot Viewer"
@@ -282,19 +749,23 @@ def display_multiple_streams():
     cv2.resizeWindow(window_name, FRAME_WIDTH, FRAME_HEIGHT) 
     cv2.moveWindow(window_name, 100, 100)
 
-    output_timestamps = deque()
-    OUTPUT_FPS_WINDOW = 5.0
+    last_output_ts = None
+    output_dt = 0.0
+
+    # Grid buffer reused across ticks, reallocated when the layout changes
+    grid = None
+    grid_layout = None
+    grid_count = None # cameras in the grid when its empty tiles were last cleared
+
+    # Created once; overlays for all cameras are drawn in parallel each tick
+    overlay_pool = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+
+    # (slot, frame_seq) of every camera at the last redraw
+    last_seqs = None
 
     try:
         while True:
-            loop_now = time.time()
-            output_timestamps.append(loop_now)
-            while output_timestamps and (loop_now - output_timestamps[0]) > OUTPUT_FPS_WINDOW:
-                output_timestamps.popleft()
-            output_fps = len(output_timestamps) / OUTPUT_FPS_WINDOW
-
-            with lock:
-                active_cams = list(cameras.values())
+            active_cams = manager.cameras_snapshot
 
             # If no cameras show "Searching" placeholder
             if not active_cams:
@@ -302,6 +773,7 @@ def display_multiple_streams():
                 cv2.putText(blank, "Searching...", (50, FRAME_HEIGHT // 2),
                             cv2.FONT_HERSHEY_SIMPLEX, 2.0, (0, 255, 255), 3)
                 cv2.imshow(window_name, blank)
+                last_seqs = None
 
                 if cv2.waitKey(1) == 27:
                     break
@@ -309,34 +781,55 @@ def display_multiple_streams():
                     break
                 continue
 
-            # Build camera grid
-            frames = []
-            for cam in active_cams:
-                frame, input_fps = cam.get_frame_and_fps()
-
-                cv2.putText(frame, f"Camera: {cam.ip}", (10, 35),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 255), 2)
-
-                cv2.putText(frame, f"Input FPS: {input_fps:.1f}", (10, 70),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-
-                cv2.putText(frame, f"Output FPS: {output_fps:.1f}", (10, 110),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 200, 255), 2)
+            # Nothing new from any camera: don't redraw, just wait a little.
+            # Still redraw now and then so stalled cameras show their FPS dropping.
+            seqs = tuple((cam.slot, cam.frame_seq) for cam in active_cams)
+            if (seqs == last_seqs and last_output_ts is not None
+                    and time.time() - last_output_ts < IDLE_REDRAW_INTERVAL):
+                if cv2.waitKey(5) == 27:
+                    break
+                if cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) < 1:
+                    break
+                continue
+            last_seqs = seqs
 
-                frames.append(frame)
+            loop_now = time.time()
+            if last_output_ts is not None:
+                output_dt = update_interval(output_dt, loop_now - last_output_ts)
+            last_output_ts = loop_now
+            output_fps = interval_fps(output_dt)
 
-            count = len(frames)
+            # Build camera grid
+            count = len(active_cams)
             cols = int(np.ceil(np.sqrt(count)))
             rows = int(np.ceil(count / cols))
-            grid = np.zeros((rows * FRAME_HEIGHT, cols * FRAME_WIDTH, 3), dtype=np.uint8)
-
-            idx = 0
-            for r in range(rows):
-                for c in range(cols):
-                    if idx < count:
-                        grid[r * FRAME_HEIGHT:(r + 1) * FRAME_HEIGHT,
-                             c * FRAME_WIDTH:(c + 1) * FRAME_WIDTH] = frames[idx]
-                    idx += 1
+            if grid_layout != (rows, cols):
+                grid = np.empty((rows * FRAME_HEIGHT, cols * FRAME_WIDTH, 3), dtype=np.uint8)
+                grid_layout = (rows, cols)
+                grid_count = None
+
+            # Only the empty tiles after the last camera need clearing, and
+            # nothing draws there, so only when the camera count changes
+            if grid_count != count:
+                for idx in range(count, rows * cols):
+                    r, c = divmod(idx, cols)
+                    grid[r * FRAME_HEIGHT:(r + 1) * FRAME_HEIGHT,
+                         c * FRAME_WIDTH:(c + 1) * FRAME_WIDTH] = 0
+                grid_count = count
+
+            # Copy every camera's front buffer into the grid in one pass
+            slots = np.array([cam.slot for cam in active_cams], dtype=np.intp)
+            fronts = np.array([cam.front_idx for cam in active_cams], dtype=np.intp)
+            tile_blit(manager.framestack, slots, fronts, grid, cols)
+
+            tiles = []
+            for idx in range(count):
+                r, c = divmod(idx, cols)
+                tiles.append(grid[r * FRAME_HEIGHT:(r + 1) * FRAME_HEIGHT,
+                                  c * FRAME_WIDTH:(c + 1) * FRAME_WIDTH])
+
+            list(overlay_pool.map(lambda cam, tile: cam.draw_overlay(tile, output_fps),
+                                  active_cams, tiles))
 
             cv2.imshow(window_name, grid)
 
@@ -347,14 +840,15 @@ def display_multiple_streams():
                 break
 
     finally:
+        overlay_pool.shutdown(wait=False)
         manager.stop()
         manager.join()
 
-        with lock:
-            for cam in cameras.values():
-                cam.force_close()
-            for cam in cameras.values():
-                cam.join(timeout=1)
+        cameras = manager.cameras_snapshot
+        for cam in cameras:
+            cam.force_close()
+        for cam in cameras:
+            cam.join(timeout=1)
 
         cv2.destroyAllWindows()
 